@@ -1,209 +1,133 @@
-import time
-from pyrfc3339 import parse
+import calendar
+from datetime import datetime
+from functools import lru_cache
+from sys import intern
 import os
-from re import search
 
-GLAB_CONVERT_TO_TIMESTAMP = False
+def _parse_csv_env(name, lower=False):
+    # Parse a comma separated environment variable into a set of values
+    value = os.getenv(name, "")
+    if lower:
+        value = value.lower()
+    return frozenset(item.strip() for item in value.split(",") if item.strip())
 
-# Check export logs is set
-if "GLAB_CONVERT_TO_TIMESTAMP" in os.environ and os.getenv('GLAB_CONVERT_TO_TIMESTAMP').lower() == "true":
-    GLAB_CONVERT_TO_TIMESTAMP = True
-else:
-    GLAB_CONVERT_TO_TIMESTAMP = False
-    
+# Check if timestamps should be converted
+GLAB_CONVERT_TO_TIMESTAMP = os.getenv('GLAB_CONVERT_TO_TIMESTAMP', "").lower() == "true"
+
+_NANO = 1000000000
+# Values that carry no information and are never exported, kept as a tuple since values may be unhashable dicts/lists
+_EMPTY_VALUES = ("", None, "None")
+
+# Attribute filters only depend on the environment, parse them once at import
+_ATTRIBUTES_DROP = frozenset([""]) | _parse_csv_env("GLAB_ATTRIBUTES_DROP", lower=True)
+_METRICS_KEEP = frozenset(["service.name","status","stage","name"]) | _parse_csv_env("GLAB_DIMENSION_METRICS", lower=True)
+
+# Environment variables the exporters can not run without
+_REQUIRED_ENV_VARS = frozenset(["GLAB_TOKEN","NEW_RELIC_API_KEY"])
+
+# Only environment variables with these prefixes are exported as span attributes
+_SPAN_ATTS_PREFIXES = ("CI","GIT","GLAB","NEW","OTEL")
+# Unwanted/sensitive environment variables never exported as span attributes
+_SPAN_ATTS_DROP = frozenset(["NEW_RELIC_API_KEY","GITLAB_FEATURES","CI_SERVER_TLS_CA_FILE","CI_RUNNER_TAGS","CI_JOB_JWT","CI_JOB_JWT_V1","CI_JOB_JWT_V2","GLAB_TOKEN","GIT_ASKPASS","CI_COMMIT_BEFORE_SHA","CI_BUILD_TOKEN","CI_DEPENDENCY_PROXY_PASSWORD","CI_RUNNER_SHORT_TOKEN","CI_BUILD_BEFORE_SHA","CI_BEFORE_SHA","OTEL_EXPORTER_OTEL_ENDPOINT","GLAB_EXPORT_PATHS","GLAB_EXPORT_PATHS_ALL","GLAB_EXPORT_PROJECTS_REGEX"]) | _parse_csv_env("GLAB_ENVS_DROP")
+
+# Pipeline and job timestamps repeat a lot, cache the parsed values
+@lru_cache(maxsize=4096)
 def do_time(string):
-    return (int(round(time.mktime(parse(string).timetuple())) * 1000000000))
+    # Fast path for UTC timestamps as returned by GitLab, e.g. 2023-01-02T03:04:05.123Z
+    if string.endswith("Z") and len(string) >= 20:
+        try:
+            return calendar.timegm((int(string[0:4]), int(string[5:7]), int(string[8:10]), int(string[11:13]), int(string[14:16]), int(string[17:19]), 0, 0, 0)) * _NANO
+        except ValueError:
+            pass
+    # Timestamps with an explicit offset, e.g. 2023-01-02T03:04:05.123+02:00, are handled by the C parser
+    try:
+        parsed = datetime.fromisoformat(string)
+        if parsed.tzinfo is not None:
+            return calendar.timegm(parsed.utctimetuple()) * _NANO
+    except ValueError:
+        pass
+    # Anything else goes through pyrfc3339, only imported when such a timestamp shows up
+    from pyrfc3339 import parse
+    return calendar.timegm(parse(string).utctimetuple()) * _NANO
 
+# Attribute names come from a small set of GitLab payload keys, cache their normalised form
+@lru_cache(maxsize=1024)
 def do_string(string):
     return str(string).lower().replace(" ", "")
 
 def do_parse(string):
-    return string != "" and string is not None and string != "None"
+    return string not in _EMPTY_VALUES
 
 def check_env_vars():
-    keys = ("GLAB_TOKEN","NEW_RELIC_API_KEY")
-
-    keys_not_set = []
-
-    for key in keys:
-        if key not in os.environ:
-            keys_not_set.append(key)
-    else:
-        pass
-
-    if len(keys_not_set) > 0: 
-        for key in keys_not_set:
+    keys_not_set = _REQUIRED_ENV_VARS - os.environ.keys()
+    if keys_not_set:
+        for key in sorted(keys_not_set):
             print(key + " not set")
         exit(1)
-    else:
-        pass # All required environment variables set
-        
 
-def grab_span_att_vars():            
-    # Grab list enviroment variables to set as span attributes
-    try:
-        atts = os.environ
-        # Remove unwanted/sensitive attributes
-        for att in atts:
-            if not att.startswith('CI') | att.startswith('GIT') | att.startswith('GLAB') | att.startswith('NEW') | att.startswith('OTEL') :
-                atts.pop(att,None)
-
-        atts_to_remove=["NEW_RELIC_API_KEY","GITLAB_FEATURES","CI_SERVER_TLS_CA_FILE","CI_RUNNER_TAGS","CI_JOB_JWT","CI_JOB_JWT_V1","CI_JOB_JWT_V2","GLAB_TOKEN","GIT_ASKPASS","CI_COMMIT_BEFORE_SHA","CI_BUILD_TOKEN","CI_DEPENDENCY_PROXY_PASSWORD","CI_RUNNER_SHORT_TOKEN","CI_BUILD_BEFORE_SHA","CI_BEFORE_SHA","OTEL_EXPORTER_OTEL_ENDPOINT","GLAB_EXPORT_PATHS","GLAB_EXPORT_PATHS_ALL","GLAB_EXPORT_PROJECTS_REGEX"]
-        if "GLAB_ENVS_DROP" in os.environ:
-            try:
-                if os.getenv("GLAB_ENVS_DROP") != "": 
-                    user_envs_to_drop =str(os.getenv("GLAB_ENVS_DROP")).split(",")
-                    for attribute in user_envs_to_drop:
-                        atts_to_remove.append(attribute)
-            except:
-                print("Unable to parse GLAB_ENVS_DROP, check your configuration")
-        
-        for item in atts_to_remove:
-            atts.pop(item, None)      
-
-    except Exception as e:
-        print(e)
-
-    return atts
-
-def parse_attributes(obj):
+def grab_span_att_vars():
+    # Grab list enviroment variables to set as span attributes, skipping unwanted/sensitive ones
+    return {att: value for att, value in os.environ.items() if att.startswith(_SPAN_ATTS_PREFIXES) and att not in _SPAN_ATTS_DROP and value not in _EMPTY_VALUES}
+
+def _parse_attributes_plain(obj):
     obj_atts = {}
-    attributes_to_drop = [""]
-    if "GLAB_ATTRIBUTES_DROP" in os.environ:
-        try:
-            if os.getenv("GLAB_ATTRIBUTES_DROP") != "": 
-                user_attributes_to_drop =str(os.getenv("GLAB_ATTRIBUTES_DROP")).lower().split(",")
-                for attribute in user_attributes_to_drop:
-                    attributes_to_drop.append(attribute)
-        except:
-            print("Unable to parse GLAB_ATTRIBUTES_DROP, check your configuration")
-
-    for attribute in obj:
-        attribute_name = str(attribute).lower()
-        if attribute_name not in attributes_to_drop:
-            if do_parse(obj[attribute]):
-                if type(obj[attribute]) is dict:
-                    for sub_att in obj[attribute]:
-                        attribute_name = do_string(attribute)+"."+do_string(sub_att)
-                        if attribute_name not in attributes_to_drop:
-                            if type(obj[attribute][sub_att]) is dict:
-                                for att in obj[attribute][sub_att]:
-                                    attribute_name = do_string(attribute)+"."+do_string(sub_att)+"."+do_string(att)
-                                    if attribute_name not in attributes_to_drop:
-                                        if GLAB_CONVERT_TO_TIMESTAMP:
-                                            if search('_at|_date',attribute_name):
-                                                if do_parse(str(obj[attribute][sub_att][att])):
-                                                    obj_atts[attribute_name]=do_time(str(obj[attribute][sub_att][att]))
-                                                else:
-                                                    obj_atts[attribute_name]=str(obj[attribute][sub_att][att])
-                                            else:
-                                                obj_atts[attribute_name]=str(obj[attribute][sub_att][att])
-                                        else:
-                                            obj_atts[attribute_name]=str(obj[attribute][sub_att][att])
-
-
-                            elif type(obj[attribute][sub_att]) is list:
-                                for key in obj[attribute][sub_att]:
-                                    if type(key) is dict:
-                                        for att in key:
-                                            if do_parse(key[att]):
-                                                attribute_name = do_string(attribute)+"."+do_string(sub_att)+"."+do_string(att)
-                                                if attribute_name not in attributes_to_drop:
-                                                    if GLAB_CONVERT_TO_TIMESTAMP:
-                                                        if search('_at|_date',attribute_name):
-                                                            if do_parse(str(key[att])):
-                                                                obj_atts[attribute_name]=do_time(str(key[att]))
-                                                            else:
-                                                                obj_atts[attribute_name]=str(key[att])
-                                                        else:
-                                                            obj_atts[attribute_name]=str(key[att])
-                                                    else:
-                                                        obj_atts[attribute_name]=str(key[att])
-                                                    
-                                    else:
-                                        attribute_name = do_string(attribute)+"."+do_string(sub_att)
-                                        if attribute_name not in attributes_to_drop:
-                                            if GLAB_CONVERT_TO_TIMESTAMP:
-                                                if search('_at|_date',attribute_name):
-                                                    if do_parse(str(key)):
-                                                        obj_atts[attribute_name]=do_time(str(key))
-                                                    else:
-                                                        obj_atts[attribute_name]=str(key)
-                                                else:
-                                                    obj_atts[attribute_name]=str(key)
-                                            else:         
-                                                obj_atts[attribute_name]=str(key)
-                            else:
-                                attribute_name = do_string(attribute)+"."+do_string(sub_att)
-                                if attribute_name not in attributes_to_drop:
-                                    if GLAB_CONVERT_TO_TIMESTAMP:
-                                        if search('_at|_date',attribute_name):
-                                            if do_parse(str(obj[attribute][sub_att])):
-                                                obj_atts[attribute_name]=do_time(str(obj[attribute][sub_att]))
-                                            else:
-                                                obj_atts[attribute_name]=str(obj[attribute][sub_att])
-                                        else:
-                                            obj_atts[attribute_name]=str(obj[attribute][sub_att])
-                                    else:
-                                        obj_atts[attribute_name]=str(obj[attribute][sub_att])
-
-                elif type(obj[attribute]) is list:
-                    for key in obj[attribute]:
-                        if type(key) is dict:
-                            for att in key:
-                                if do_parse(key[att]):
-                                    attribute_name = do_string(attribute)+"."+do_string(att)
-                                    if attribute_name not in attributes_to_drop:
-                                        if GLAB_CONVERT_TO_TIMESTAMP:
-                                            if search('_at|_date',attribute_name):
-                                                if do_parse(str(key[att])):
-                                                    obj_atts[attribute_name]=do_time(str(key[att]))
-                                                else:
-                                                    obj_atts[attribute_name]=str(key[att])
-                                            else:
-                                                obj_atts[attribute_name]=str(key[att])
-                                        else:
-                                            obj_atts[attribute_name]=str(key[att])
+    # Attributes are flattened up to attribute.sub.att, anything nested deeper is exported as its string form
+    for attribute, value in obj.items():
+        if str(attribute).lower() in _ATTRIBUTES_DROP or value in _EMPTY_VALUES:
+            continue
+        if type(value) is dict:
+            prefix = do_string(attribute) + "."
+            for sub_att, sub_value in value.items():
+                sub_name = prefix + do_string(sub_att)
+                if sub_name in _ATTRIBUTES_DROP:
+                    continue
+                if type(sub_value) is dict:
+                    for att, att_value in sub_value.items():
+                        attribute_name = sub_name + "." + do_string(att)
+                        if attribute_name not in _ATTRIBUTES_DROP:
+                            obj_atts[intern(attribute_name)]=str(att_value)
+                elif type(sub_value) is list:
+                    for item in sub_value:
+                        if type(item) is dict:
+                            for att, att_value in item.items():
+                                attribute_name = sub_name + "." + do_string(att)
+                                if att_value not in _EMPTY_VALUES and attribute_name not in _ATTRIBUTES_DROP:
+                                    obj_atts[intern(attribute_name)]=str(att_value)
+                        else:
+                            obj_atts[intern(sub_name)]=str(item)
                 else:
-                    if do_parse(obj[attribute]):
-                        attribute_name = do_string(attribute)
-                        if attribute_name not in attributes_to_drop:
-                            if GLAB_CONVERT_TO_TIMESTAMP:
-                                if search('_at|_date',attribute_name):
-                                    if do_parse(str(obj[attribute])):
-                                        obj_atts[attribute_name]=do_time(str(obj[attribute]))
-                                    else:
-                                        obj_atts[attribute_name]=str(obj[attribute])
-                                else:
-                                    obj_atts[attribute_name]=str(obj[attribute])
-                            else:
-                                obj_atts[attribute_name]=str(obj[attribute])
+                    obj_atts[intern(sub_name)]=str(sub_value)
+        elif type(value) is list:
+            # Only dict elements of top level lists are exported, lists of scalars such as tag_list are skipped
+            prefix = do_string(attribute) + "."
+            for item in value:
+                if type(item) is dict:
+                    for att, att_value in item.items():
+                        attribute_name = prefix + do_string(att)
+                        if att_value not in _EMPTY_VALUES and attribute_name not in _ATTRIBUTES_DROP:
+                            obj_atts[intern(attribute_name)]=str(att_value)
+        else:
+            attribute_name = do_string(attribute)
+            if attribute_name not in _ATTRIBUTES_DROP:
+                obj_atts[attribute_name]=str(value)
+    return obj_atts
+
+def _parse_attributes_with_time(obj):
+    obj_atts = _parse_attributes_plain(obj)
+    # Convert the final value of every timestamp attribute, replacing values doesn't resize the dict
+    for attribute_name, value in obj_atts.items():
+        if ("_at" in attribute_name or "_date" in attribute_name) and value not in _EMPTY_VALUES:
+            obj_atts[attribute_name]=do_time(value)
     return obj_atts
 
+# GLAB_CONVERT_TO_TIMESTAMP is fixed at import, pick the matching variant once
+parse_attributes = _parse_attributes_with_time if GLAB_CONVERT_TO_TIMESTAMP else _parse_attributes_plain
+
 def parse_metrics_attributes(attributes):
-    metrics_attributes_to_keep = ["service.name","status","stage","name"]
-    metrics_attributes = {}
-    if "GLAB_DIMENSION_METRICS" in os.environ:
-        try:
-            if os.getenv("GLAB_DIMENSION_METRICS") != "": 
-                user_attributes_to_keep = str(os.getenv("GLAB_DIMENSION_METRICS")).lower().split(",")
-                for attribute in user_attributes_to_keep:
-                    metrics_attributes_to_keep.append(attribute)
-        except:
-            print("Unable to parse GLAB_DIMENSION_METRICS, exporting with default dimensions, check your configuration")
-
-    for attribute in attributes:
-        if str(attribute).lower() in metrics_attributes_to_keep: #Choose attributes to keep as dimensions
-            metrics_attributes[str(attribute).lower()]=attributes[str(attribute).lower()]
-
-    if "queued_duration" in attributes:
-        queued_duration=float(attributes["queued_duration"])
-    else:
-        queued_duration=0    
-
-    if "duration" in attributes:
-        duration=float(attributes["duration"])
-    else:
-        duration=0
-
-    return duration, queued_duration, metrics_attributes    
\ No newline at end of file
+    # Attribute names are already lowercased by parse_attributes, only look up the dimensions to keep
+    metrics_attributes = {attribute: attributes[attribute] for attribute in _METRICS_KEEP if attribute in attributes}
+
+    queued_duration = float(attributes.get("queued_duration", 0))
+    duration = float(attributes.get("duration", 0))
+
+    return duration, queued_duration, metrics_attributes
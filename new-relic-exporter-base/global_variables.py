@@ -1,11 +1,21 @@
 import os
 from custom_parsers import check_env_vars
 import gitlab
-from queue import Queue
+from requests.adapters import HTTPAdapter
+from queue import SimpleQueue
 
 #Ensure that mandatory variables are configured before starting
 check_env_vars()
 
+def _env_flag(name, default):
+    # Boolean env flags only move away from their default on an explicit "true"/"false"
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    if default:
+        return value.lower() != "false"
+    return value.lower() == "true"
+
 # global variables 
 global GLAB_STANDALONE
 global GLAB_EXPORT_LAST_MINUTES
@@ -28,7 +38,10 @@ global q
 global GLAB_RUNNERS_INSTANCE
 
 # Initializing a queue
-q = Queue()
+q = SimpleQueue()
+
+# Jobs in these stages run the exporters themselves and are never exported
+EXPORTER_STAGES = frozenset(["new-relic-exporter", "new-relic-metrics-exporter"])
 
 GLAB_DORA_METRICS=False
 GLAB_EXPORT_LOGS=True
@@ -46,30 +59,19 @@ GLAB_RUNNERS_SCOPE = ["all",]
 GLAB_RUNNERS_INSTANCE = True
 
 # Check runners permissions to obtain all runners in instance
-if "GLAB_RUNNERS_INSTANCE" in os.environ and os.getenv('GLAB_RUNNERS_INSTANCE').lower() == "false":
-    GLAB_RUNNERS_INSTANCE = False
-else:
-    GLAB_RUNNERS_INSTANCE = True
-           
-           
-# Check export logs is set
-if "GLAB_DORA_METRICS" in os.environ and os.getenv('GLAB_DORA_METRICS').lower() == "true":
-    GLAB_DORA_METRICS = os.getenv('GLAB_DORA_METRICS')
-else:
-    GLAB_DORA_METRICS=False
-    
+GLAB_RUNNERS_INSTANCE = _env_flag("GLAB_RUNNERS_INSTANCE", GLAB_RUNNERS_INSTANCE)
+
+# Check dora metrics is set
+GLAB_DORA_METRICS = _env_flag("GLAB_DORA_METRICS", GLAB_DORA_METRICS)
+
 # Check export logs is set
-if "GLAB_EXPORT_LOGS" in os.environ and os.getenv('GLAB_EXPORT_LOGS').lower() == "false":
-    GLAB_EXPORT_LOGS = False
-else:
-    GLAB_EXPORT_LOGS = True
+GLAB_EXPORT_LOGS = _env_flag("GLAB_EXPORT_LOGS", GLAB_EXPORT_LOGS)
            
 # Check if project name regex is set
 if "GLAB_EXPORT_PROJECTS_REGEX" in os.environ:
     GLAB_EXPORT_PROJECTS_REGEX = os.getenv('GLAB_EXPORT_PROJECTS_REGEX')
 
-if "GLAB_EXPORT_PATHS_ALL" in os.environ and os.getenv('GLAB_EXPORT_PATHS_ALL').lower() == "true":
-    GLAB_EXPORT_PATHS_ALL = True
+GLAB_EXPORT_PATHS_ALL = _env_flag("GLAB_EXPORT_PATHS_ALL", GLAB_EXPORT_PATHS_ALL)
 
 # Check base path
 if "GLAB_EXPORT_PATHS" in os.environ:
@@ -78,31 +80,25 @@ else:
     if "CI_PROJECT_NAMESPACE" in os.environ:
         GLAB_EXPORT_PATHS = os.getenv('CI_PROJECT_NAMESPACE')
 
-if GLAB_EXPORT_PATHS != "":
-    paths = GLAB_EXPORT_PATHS.split(",")
-else:
-    paths = ""
+# Namespaces are checked against every project, keep them in a set
+paths = frozenset(path for path in GLAB_EXPORT_PATHS.split(",") if path)
 
-# Set gitlab client
-GLAB_ENDPOINT = ""
-if "GLAB_ENDPOINT" in os.environ:
-    GLAB_ENDPOINT = os.getenv('GLAB_ENDPOINT')
-    gl = gitlab.Gitlab(url=str(GLAB_ENDPOINT),private_token="{}".format(GLAB_TOKEN))
-else:
-    GLAB_ENDPOINT="https://gitlab.com/"
-    gl = gitlab.Gitlab(private_token="{}".format(GLAB_TOKEN))
+# Set gitlab client, defaults to gitlab.com when no endpoint is configured
+GLAB_ENDPOINT = os.getenv('GLAB_ENDPOINT', "https://gitlab.com/")
+gl = gitlab.Gitlab(url=str(GLAB_ENDPOINT),private_token="{}".format(GLAB_TOKEN))
+# Size the connection pool for the concurrent pipeline and job requests
+gl.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+gl.session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
 
 # Check project ownership and visibility     
-if "GLAB_PROJECT_OWNERSHIP" in os.environ and os.getenv('GLAB_PROJECT_OWNERSHIP').lower() == "false":
-    GLAB_PROJECT_OWNERSHIP = False  
+GLAB_PROJECT_OWNERSHIP = _env_flag("GLAB_PROJECT_OWNERSHIP", GLAB_PROJECT_OWNERSHIP)
    
         
 if "GLAB_PROJECT_VISIBILITIES" in os.environ:
     GLAB_PROJECT_VISIBILITIES = os.getenv('GLAB_PROJECT_VISIBILITIES').split(",")
     
 # Check if we running as pipeline schedule or standalone mode   
-if "GLAB_STANDALONE" in os.environ and os.getenv('GLAB_STANDALONE').lower() == "true":
-    GLAB_STANDALONE = True
+GLAB_STANDALONE = _env_flag("GLAB_STANDALONE", GLAB_STANDALONE)
   
     
 # Check if we using default amount data to export
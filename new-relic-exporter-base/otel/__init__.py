@@ -16,23 +16,25 @@ from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 
 def create_resource_attributes(atts, GLAB_SERVICE_NAME):
-    attributes={SERVICE_NAME: GLAB_SERVICE_NAME}
-    for att in atts:     
-        if att != "name":
-            attributes[att]=atts[att]
-        else:
-            attributes["resource.name"]=atts[att]
+    attributes={SERVICE_NAME: GLAB_SERVICE_NAME, **atts}
+    # "name" is reserved on log records, export it as resource.name
+    if "name" in attributes:
+        attributes["resource.name"]=attributes.pop("name")
     return attributes
 
+# Size of the batch log queue, records logged beyond it before an export are dropped by the SDK
+LOG_QUEUE_SIZE = 8192
+
 def get_logger(endpoint, headers, resource, name):
     exporter = OTLPLogExporter(endpoint=endpoint,headers=headers)
     logger = logging.getLogger(str(name))
     logger.handlers.clear()
     logger_provider = LoggerProvider(resource=resource)
-    logger_provider.add_log_record_processor(BatchLogRecordProcessor(exporter))
+    # Records are exported from a background thread, callers logging in bulk must force_flush the provider before the queue fills
+    logger_provider.add_log_record_processor(BatchLogRecordProcessor(exporter, max_queue_size=LOG_QUEUE_SIZE))
     handler = LoggingHandler(level=logging.NOTSET, logger_provider=logger_provider)
     logger.addHandler(handler)
-    return logger
+    return logger, logger_provider
 
 def get_meter(endpoint, headers, resource, meter):
     reader = PeriodicExportingMetricReader(OTLPMetricExporter(endpoint=endpoint,headers=headers))
@@ -6,10 +6,13 @@ from opentelemetry import trace
 from opentelemetry.instrumentation.logging import LoggingInstrumentor
 from opentelemetry.sdk.resources import SERVICE_NAME, Resource
 from opentelemetry.trace import Status, StatusCode
-from otel import create_resource_attributes, get_logger, get_tracer
+from otel import LOG_QUEUE_SIZE, create_resource_attributes, get_logger, get_tracer
 from global_variables import *
 import re
 
+# Strips terminal colour codes from job logs, compiled once for all jobs
+ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
 def send_to_nr():
     # Set local variables
     project_id = os.getenv('CI_PROJECT_ID')
@@ -26,7 +29,7 @@ def send_to_nr():
         #Ensure we don't export data for new relic exporters
         for job in jobs:
             job_json = json.loads(job.to_json())
-            if str(job_json['stage']).lower() not in ["new-relic-exporter", "new-relic-metrics-exporter"]:
+            if str(job_json['stage']).lower() not in EXPORTER_STAGES:
                 job_lst.append(job_json)
                 
         if len(job_lst) == 0:
@@ -36,15 +39,16 @@ def send_to_nr():
     except Exception as e:
         print(e)
         
-    #Set variables to use for OTEL metrics and logs exporters
-    global_resource = Resource(attributes={
+    #Set variables to use for OTEL metrics and logs exporters, job resources extend these base attributes
+    base_resource_attributes = {
     SERVICE_NAME: GLAB_SERVICE_NAME,
     "instrumentation.name": "gitlab-integration",
-    "pipeline_id": str(os.getenv('CI_PARENT_PIPELINE')),
-    "project_id": str(os.getenv('CI_PROJECT_ID')),
+    "pipeline_id": str(pipeline_id),
+    "project_id": str(project_id),
     "gitlab.source": "gitlab-exporter",
     "gitlab.resource.type": "span"
-    })
+    }
+    global_resource = Resource(attributes=base_resource_attributes)
     
     LoggingInstrumentor().instrument(set_logging_format=True,log_level=logging.INFO)
     
@@ -83,7 +87,7 @@ def send_to_nr():
         pcontext = trace.set_span_in_context(p_parent)
         for job in job_lst:
             #Set job level tracer and logger
-            resource_attributes ={SERVICE_NAME: GLAB_SERVICE_NAME,"pipeline_id": str(os.getenv('CI_PARENT_PIPELINE')),"project_id": str(os.getenv('CI_PROJECT_ID')),"job_id": str(job["id"]),"instrumentation.name": "gitlab-integration","gitlab.source": "gitlab-exporter","gitlab.resource.type": "span"}
+            resource_attributes = {**base_resource_attributes, "job_id": str(job["id"])}
             if GLAB_LOW_DATA_MODE:
                 pass
             else:
@@ -101,7 +105,6 @@ def send_to_nr():
                     child = job_tracer.start_span(name="Stage: " + str(job['name'])+" - job_id: "+ str(job['id']), start_time=do_time(job['started_at']),context=pcontext, kind=trace.SpanKind.CONSUMER)
                     with trace.use_span(child, end_on_exit=False):
                         try:
-                            ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
                             if job['status'] == "failed":
                                 current_job = project.jobs.get(job['id'], lazy=True)
                                 with open("job.log", "wb") as f:
@@ -119,7 +122,7 @@ def send_to_nr():
                             if GLAB_LOW_DATA_MODE:
                                 pass
                             else:
-                                child.set_attributes(parse_attributes(job))
+                                child.set_attributes(job_attributes)
 
                             if GLAB_EXPORT_LOGS:
                                 try:
@@ -135,41 +138,32 @@ def send_to_nr():
                                             if string.decode('utf-8').startswith('ERROR:'):
                                                 err = True
                                                 
-                                    with open("job.log", "rb") as f:
-                                        resource_attributes_base ={SERVICE_NAME: GLAB_SERVICE_NAME,"pipeline_id": str(os.getenv('CI_PARENT_PIPELINE')),"project_id": str(os.getenv('CI_PROJECT_ID')),"job_id": str(job["id"]),"instrumentation.name": "gitlab-integration","gitlab.source": "gitlab-exporter","gitlab.resource.type": "span","stage.name":str(job_json['stage'])}
-                                        if err:
-                                            count = 1
-                                            for string in f:
-                                                txt = str(ansi_escape.sub(' ', str(string.decode('utf-8', 'ignore'))))
-                                                if string.decode('utf-8') != "\n" and len(txt) > 2:
-                                                    if count == 1:
-                                                        resource_attributes["message"] = txt
-                                                        resource_attributes.update(resource_attributes_base)
-                                                        resource_log = Resource(attributes=resource_attributes)
-                                                        job_logger = get_logger(endpoint,headers,resource_log, "job_logger")
-                                                        job_logger.error("")
-                                                    else:
-                                                        resource_attributes_base["message"] = txt
-                                                        resource_log = Resource(attributes=resource_attributes_base)
-                                                        job_logger = get_logger(endpoint,headers,resource_log, "job_logger")
-                                                        job_logger.error("")
-                                                    count += 1
-                                        else: 
-                                            count = 1
-                                            for string in f:
-                                                txt = str(ansi_escape.sub(' ', str(string.decode('utf-8', 'ignore'))))
-                                                if string.decode('utf-8') != "\n" and len(txt) > 2:
-                                                    if count == 1:
-                                                        resource_attributes["message"] = txt
-                                                        resource_log = Resource(attributes=resource_attributes)
-                                                        job_logger = get_logger(endpoint,headers,resource_log, "job_logger")
-                                                        job_logger.info("")
-                                                    else:
-                                                        resource_attributes_base["message"] = txt
-                                                        resource_log = Resource(attributes=resource_attributes_base)
-                                                        job_logger = get_logger(endpoint,headers,resource_log, "job_logger")
-                                                        job_logger.info("")
-                                                    count += 1
+                                    # One logger per job, every log line is sent as the message of a record
+                                    resource_attributes_base = {**base_resource_attributes, "job_id": str(job["id"]), "stage.name": str(job['stage'])}
+                                    job_logger, job_logger_provider = get_logger(endpoint,headers,Resource(attributes=resource_attributes_base), "job_logger")
+                                    # Job logs are only exported, don't echo them into this exporter's own CI log
+                                    job_logger.propagate = False
+                                    try:
+                                        log_level = logging.ERROR if err else logging.INFO
+                                        # Check the level once per job rather than for every line
+                                        if job_logger.isEnabledFor(log_level):
+                                            with open("job.log", "rb") as f:
+                                                count = 1
+                                                for string in f:
+                                                    txt = str(ansi_escape.sub(' ', str(string.decode('utf-8', 'ignore'))))
+                                                    if string.decode('utf-8') != "\n" and len(txt) > 2:
+                                                        if count == 1:
+                                                            # First line also carries the job attributes
+                                                            job_logger._log(level=log_level,msg=txt,extra=resource_attributes,args="")
+                                                        else:
+                                                            job_logger._log(level=log_level,msg=txt,args="")
+                                                        # Reading the file is faster than exporting, flush before the batch queue fills and drops lines
+                                                        if count % LOG_QUEUE_SIZE == 0:
+                                                            job_logger_provider.force_flush()
+                                                        count += 1
+                                    finally:
+                                        # The provider is not reused, shutdown flushes the remaining lines and releases its export thread and channel
+                                        job_logger_provider.shutdown()
 
                                 except Exception as e:
                                     print(e)
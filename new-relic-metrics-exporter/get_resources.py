@@ -3,20 +3,16 @@ from datetime import datetime, timedelta, date, timezone
 import pytz
 import zulu
 from opentelemetry.sdk.resources import Resource
-from otel import get_logger, create_resource_attributes
 from custom_parsers import parse_attributes, parse_metrics_attributes
-from otel import get_logger, get_meter, create_resource_attributes
-from custom_parsers import parse_attributes
+from otel import LOG_QUEUE_SIZE, get_logger, get_meter, create_resource_attributes
 from opentelemetry.instrumentation.logging import LoggingInstrumentor
 from opentelemetry.sdk.resources import SERVICE_NAME
-import re
 from global_variables import *
+import re
 import requests
+from requests.adapters import HTTPAdapter
 import logging
-import asyncio
-import time
 import concurrent.futures
-from concurrent.futures import wait
 
 LoggingInstrumentor().instrument(set_logging_format=True,log_level=logging.INFO)
 
@@ -28,7 +24,7 @@ global_resource_attributes ={
 global_resource = Resource(attributes=global_resource_attributes)
 
 #Global logger
-global_logger = get_logger(endpoint,headers,global_resource,"global_logger")
+global_logger, global_logger_provider = get_logger(endpoint,headers,global_resource,"global_logger")
 
 
 #Global meter
@@ -37,6 +33,15 @@ gitlab_pipelines_duration=global_meter.create_up_down_counter("gitlab_pipelines.
 gitlab_pipelines_queued_duration=global_meter.create_up_down_counter("gitlab_pipelines.queued_duration")
 gitlab_jobs_duration=global_meter.create_up_down_counter("gitlab_jobs.duration")
 gitlab_jobs_queued_duration=global_meter.create_up_down_counter("gitlab_jobs.queued_duration")
+
+# Compile project name regex once, it is matched against every project
+projects_regex = re.compile(GLAB_EXPORT_PROJECTS_REGEX)
+
+# Shared HTTP session for direct GitLab API calls, keeps connections alive between requests
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=10))
+_SESSION.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=10))
+_SESSION.headers.update({'PRIVATE-TOKEN': GLAB_TOKEN})
                 
 def get_runners():
     try:
@@ -64,48 +69,48 @@ def get_runners():
                 for runner in runners:
                     runner_json = json.loads(runner.to_json())
                     runner_attributes = create_resource_attributes(parse_attributes(runner_json),GLAB_SERVICE_NAME)                
-                    runner_attributes.update({"gitlab.resource.type": "runner"})
+                    runner_attributes["gitlab.resource.type"] = "runner"
                     #Send runner data as log events with attributes
                     msg = "Runner: "+ str(runner_json['id'])
                     global_logger._log(level=logging.INFO,msg=msg,extra=runner_attributes,args="")
-                    print("Log events sent for runner: " + str(runner_json['id']))
+                    print("Log events sent for " + msg)
                     
     except Exception as e:
         print("Unable to obtain runners due to ",str(e))
         
 async def grab_data(project):
+    # Resolve project details once and reuse them for the rest of the export
+    GLAB_SERVICE_NAME = str((project.attributes.get('name_with_namespace'))).lower().replace(" ", "")
+    # Report whether the project was exported without errors
+    exported = True
     try:
         # Collect project information
-        GLAB_SERVICE_NAME = str((project.attributes.get('name_with_namespace'))).lower().replace(" ", "")
         project_json = json.loads(project.to_json())
+        project_id = project_json["id"]
         # Check if we should export only data for specific groups/projects
         if GLAB_EXPORT_PATHS_ALL or (paths and str(project_json["namespace"]["full_path"]) in paths):
-            if re.search(str(GLAB_EXPORT_PROJECTS_REGEX), project_json["name"]):
+            if projects_regex.search(project_json["name"]):
                 try:
-                    print("Project: "+str((project.attributes.get('name_with_namespace'))).lower().replace(" ", "") + " matched configuration, collecting data...")
-                    project_id = json.loads(project.to_json())["id"]
-                    GLAB_SERVICE_NAME = str((project.attributes.get('name_with_namespace'))).lower().replace(" ", "")
-                    await asyncio.gather(get_pipelines(project,project_id,GLAB_SERVICE_NAME))
-                    await asyncio.gather(get_deployments(project,project_id,GLAB_SERVICE_NAME)) 
-                    await asyncio.gather(get_environments(project,project_id,GLAB_SERVICE_NAME))
-                    await asyncio.gather(get_releases(project,project_id,GLAB_SERVICE_NAME))
+                    # Collect per project counters and report them as a single summary line
+                    project_summary = {}
+                    project_summary["pipelines"] = await get_pipelines(project,project_id,GLAB_SERVICE_NAME)
+                    project_summary["deployments"] = await get_deployments(project,project_id,GLAB_SERVICE_NAME)
+                    project_summary["environments"] = await get_environments(project,project_id,GLAB_SERVICE_NAME)
+                    project_summary["releases"] = await get_releases(project,project_id,GLAB_SERVICE_NAME)
                     if q.qsize() != 0:
+                        parsed = 0
                         while q.qsize() > 0:
                             data = q.get()
-                            if data[3] == "deployment":
-                                parse_deployment(data)
-                            elif data[3] == "environment":
-                                parse_environment(data)
-                            elif data[3] == "release":
-                                parse_release(data)
-                            elif data[3] == "pipeline":
-                                parse_pipeline(data)
-                            elif data[3] == "job":
-                                parse_job(data)
-                            # To bypass issues with overloading global logger with too much data
-                            time.sleep(0.05)
+                            resource_parsers[data[3]](data)
+                            parsed += 1
+                            # The global logger is shared with the runners thread, flush well before its queue fills and drops records
+                            if parsed % (LOG_QUEUE_SIZE // 2) == 0:
+                                global_logger_provider.force_flush()
+                        global_logger_provider.force_flush()
+                    print("Project: " + str(GLAB_SERVICE_NAME) + " matched configuration, pipelines: " + str(project_summary["pipelines"]) + ", deployments: " + str(project_summary["deployments"]) + ", environments: " + str(project_summary["environments"]) + ", releases: " + str(project_summary["releases"]))
                 except Exception as e:
-                    print(str(e) + " -> Failed to collect data for project:  "+str((project.attributes.get('name_with_namespace'))).lower().replace(" ", "")+" check your configuration.",project_json)
+                    print(str(e) + " -> Failed to collect data for project:  "+str(GLAB_SERVICE_NAME)+" check your configuration.",project_json)
+                    exported = False
                 if GLAB_DORA_METRICS:
                     try:
                         get_dora_metrics(project)
@@ -115,14 +120,16 @@ async def grab_data(project):
                 if zulu.parse(project_json["last_activity_at"]) >= (datetime.now(timezone.utc).replace(tzinfo=pytz.utc) - timedelta(minutes=int(GLAB_EXPORT_LAST_MINUTES))):
                     #Send project information as log events with attributes
                     c_attributes = create_resource_attributes(parse_attributes(project_json), GLAB_SERVICE_NAME)
-                    c_attributes.update({"gitlab.resource.type": "project"})
-                    msg = "Project: "+ str(project_json['id']) + " - "+ str(GLAB_SERVICE_NAME) 
+                    c_attributes["gitlab.resource.type"] = "project"
+                    msg = "Project: "+ str(project_id) + " - "+ str(GLAB_SERVICE_NAME) 
                     global_logger._log(level=logging.INFO,msg=msg,extra=c_attributes,args="")
-                    print("Log events sent for project: " + str(project_json['id']) + " - " + str(GLAB_SERVICE_NAME))              
+                    print("Log events sent for " + msg)
             else:
-                print("No project name matched configured regex " + "\"" + str(GLAB_EXPORT_PROJECTS_REGEX)+ "\" in paths " + "\""+str(paths)+"\"")
+                print("No project name matched configured regex " + "\"" + str(GLAB_EXPORT_PROJECTS_REGEX)+ "\" in paths " + "\""+str(GLAB_EXPORT_PATHS)+"\"")
     except Exception as e:
-        print(str(e) + " -> ERROR obtaining data for project:  "+str((project.attributes.get('name_with_namespace'))).lower().replace(" ", ""))
+        print(str(e) + " -> ERROR obtaining data for project:  "+str(GLAB_SERVICE_NAME))
+        exported = False
+    return exported
 
 def get_dora_metrics(current_project):
     GLAB_SERVICE_NAME = str((current_project.attributes.get('name_with_namespace'))).lower().replace(" ", "")
@@ -133,9 +140,6 @@ def get_dora_metrics(current_project):
     time_to_restore_service = str(GLAB_ENDPOINT)+"/api/v4/projects/"+str(project_id)+"/dora/metrics?metric=time_to_restore_service&start_date"+str(today)
     change_failure_rate = str(GLAB_ENDPOINT)+"/api/v4/projects/"+str(project_id)+"/dora/metrics?metric=change_failure_rate&start_date"+str(today)
     metrics = {"deployment_frequency":deployment_frequency,"lead_time_for_changes":lead_time_for_changes,"time_to_restore_service":time_to_restore_service,"change_failure_rate":change_failure_rate}
-    req_headers = {
-    'PRIVATE-TOKEN': GLAB_TOKEN,
-    }
     attributes_dora_metrics ={
         SERVICE_NAME: GLAB_SERVICE_NAME,
         "instrumentation.name": "gitlab-integration",
@@ -148,8 +152,16 @@ def get_dora_metrics(current_project):
         }
     dora_metrics_resource = Resource(attributes=attributes_dora_metrics)
     meter = get_meter(endpoint, headers, dora_metrics_resource, str(project_id))
+    # DORA metrics endpoints don't depend on each other, request them concurrently
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(metrics)) as executor:
+        requests_dora = {metric: executor.submit(_SESSION.get, metrics[metric]) for metric in metrics}
     for metric in metrics:
-        r = requests.get(metrics[metric],headers=req_headers)
+        # A failing endpoint only skips its own metric
+        try:
+            r = requests_dora[metric].result()
+        except Exception as e:
+            print("Unable to obtain DORA metric " + str(metric) + " for project " + str(project_id) + " due to ", e)
+            continue
         dora=meter.create_counter("gitlab_dora_"+str(metric))
         if r.status_code == 200 and len(r.text) > 2:
             #Create metrics we want to populate
@@ -169,11 +181,11 @@ def parse_deployment(data):
     GLAB_SERVICE_NAME = data[2]
     try:
         deployment_attributes = create_resource_attributes(parse_attributes(deployment_json), GLAB_SERVICE_NAME)
-        deployment_attributes.update({"gitlab.resource.type": "deployment"})
+        deployment_attributes["gitlab.resource.type"] = "deployment"
         #Send deployment data as log events with attributes
         msg = "Deployment: "+ str(deployment_json['id'])+ " from project: " + str(project_id) + " - " + str(GLAB_SERVICE_NAME) 
         global_logger._log(level=logging.INFO,msg=msg,extra=deployment_attributes,args="")   
-        print("Log events sent for deployment: " + str(deployment_json['id'])+ " from project: " + str(project_id) + " - " + str(GLAB_SERVICE_NAME))
+        print("Log events sent for " + msg)
     except Exception as e:
             print("Failed to obtain deployments for project",project_id," due to error ", e)
      
@@ -182,15 +194,16 @@ async def get_deployments(current_project,project_id,GLAB_SERVICE_NAME):
     deployments = current_project.deployments.list(get_all=True, order_by="created_at", sort="desc")
     deployments_matching=0
     if len(deployments) > 0: # check if there are deployments in this project
+        # Only export deployments created within the export window, computed once for all deployments
+        export_after = datetime.now(timezone.utc).replace(tzinfo=pytz.utc) - timedelta(minutes=int(GLAB_EXPORT_LAST_MINUTES))
         for deployment in deployments:
             deployment_json = json.loads(deployment.to_json())
-            if zulu.parse(deployment_json["created_at"]) >= (datetime.now(timezone.utc).replace(tzinfo=pytz.utc) - timedelta(minutes=int(GLAB_EXPORT_LAST_MINUTES))):
+            if zulu.parse(deployment_json["created_at"]) >= export_after:
                 q.put([deployment_json,project_id,GLAB_SERVICE_NAME,"deployment"])
                 deployments_matching +=1
             else:
                 break
-        print("Number of deployments found",str(len(deployments)))
-        print("Number of deployments that matched export configuration",str(deployments_matching))
+    return str(deployments_matching) + "/" + str(len(deployments))
 
 def parse_environment(data):
     environment_json = data[0]
@@ -198,11 +211,11 @@ def parse_environment(data):
     GLAB_SERVICE_NAME = data[2]
     try:
         environment_attributes = create_resource_attributes(parse_attributes(environment_json),GLAB_SERVICE_NAME)
-        environment_attributes.update({"gitlab.resource.type": "environment"})
+        environment_attributes["gitlab.resource.type"] = "environment"
         #Send environment data as log events with attributes   
         msg = "Environment: "+ str(environment_json['id'])+ " from project: " + str(project_id) + " - " + str(GLAB_SERVICE_NAME) 
         global_logger._log(level=logging.INFO,msg=msg,extra=environment_attributes,args="")          
-        print("Log events sent for environment: " + str(environment_json['id'])+ " from project: " + str(project_id) + " - " + str(GLAB_SERVICE_NAME))
+        print("Log events sent for " + msg)
     except Exception as e:
         print("Failed to obtain environments for project",project_id," due to error ", e)
                     
@@ -214,10 +227,7 @@ async def get_environments(current_project,project_id,GLAB_SERVICE_NAME):
             environment_json = json.loads(environment.to_json())
             # we should send data for every environment each time 
             q.put([environment_json,project_id,GLAB_SERVICE_NAME,"environment"])
-            
-        print("Number of environments found",str(len(environments)))
-    else: 
-        print("No environments found in project ",str(project_id))
+    return len(environments)
 
         
 def parse_release(data):
@@ -226,11 +236,11 @@ def parse_release(data):
     GLAB_SERVICE_NAME = data[2]
     try:
         release_attributes = create_resource_attributes(parse_attributes(release_json),GLAB_SERVICE_NAME)
-        release_attributes.update({"gitlab.resource.type": "release"})
+        release_attributes["gitlab.resource.type"] = "release"
         #Send releases data as log events with attributes
         msg = "Release: "+ str(release_json['tag_name'])+ " from project: " + str(project_id) + " - " + str(GLAB_SERVICE_NAME) 
         global_logger._log(level=logging.INFO,msg=msg,extra=release_attributes,args="")      
-        print("Log events sent for release: " + str(release_json['tag_name'])+ " from project: " + str(project_id) + " - " + str(GLAB_SERVICE_NAME))
+        print("Log events sent for " + msg)
     except Exception as e:
         print("Failed to obtain environments for project",project_id," due to error ", e)
            
@@ -239,16 +249,16 @@ async def get_releases(current_project,project_id,GLAB_SERVICE_NAME):
     releases = current_project.releases.list(get_all=True, order_by="created_at", sort="desc")
     releases_matching = 0
     if len(releases) > 0: # check if there are releases in this project
+        # Only export releases created within the export window, computed once for all releases
+        export_after = datetime.now(timezone.utc).replace(tzinfo=pytz.utc) - timedelta(minutes=int(GLAB_EXPORT_LAST_MINUTES))
         for release in releases:
             release_json = json.loads(release.to_json())
-            if zulu.parse(release_json["created_at"]) >= (datetime.now(timezone.utc).replace(tzinfo=pytz.utc) - timedelta(minutes=int(GLAB_EXPORT_LAST_MINUTES))):
+            if zulu.parse(release_json["created_at"]) >= export_after:
                 q.put([release_json,project_id,GLAB_SERVICE_NAME,"release"])
                 releases_matching += 1
             else:
                 break
-            
-        print("Number of releases found",str(len(releases)))
-        print("Number of releases that matched export configuration",str(releases_matching))
+    return str(releases_matching) + "/" + str(len(releases))
 
 def parse_pipeline(data):
     pipeline_json=json.loads(data[0].to_json())
@@ -256,22 +266,20 @@ def parse_pipeline(data):
     GLAB_SERVICE_NAME = data[2]
     pipeline_id = pipeline_json['id']
     try:
-        attributes_pip = {"gitlab.resource.type": "pipeline"}
         # Grab pipeline attributes
         current_pipeline_attributes = create_resource_attributes(parse_attributes(pipeline_json),GLAB_SERVICE_NAME)      
         # Check wich dimension to set on each metric
         currrent_pipeline_metrics_attributes = parse_metrics_attributes(current_pipeline_attributes)
-        currrent_pipeline_metrics_attributes[2].update(attributes_pip)
+        currrent_pipeline_metrics_attributes[2]["gitlab.resource.type"] = "pipeline"
         # Update attributes for the log events
-        current_pipeline_attributes.update(attributes_pip)
+        current_pipeline_attributes["gitlab.resource.type"] = "pipeline"
         # Send pipeline metrics with configured dimensions
         gitlab_pipelines_duration.add(float(currrent_pipeline_metrics_attributes[0]),currrent_pipeline_metrics_attributes[2])
         gitlab_pipelines_queued_duration.add(float(currrent_pipeline_metrics_attributes[1]),currrent_pipeline_metrics_attributes[2])
         # Send pipeline data as log events with attributes
         msg = "Pipeline: "+ str(pipeline_id)+ " - " + "from project: " + str(project_id)+ " - " + str(GLAB_SERVICE_NAME) 
         global_logger._log(level=logging.INFO,msg=msg,extra=current_pipeline_attributes,args="")   
-        print("Metrics sent for pipeline: " + str(pipeline_id)+ " - " + "from project: " + str(project_id)+ " - " + str(GLAB_SERVICE_NAME))
-        print("Log events sent for pipeline: " + str(pipeline_id)+ " - " + "from project: " + str(project_id)+ " - " + str(GLAB_SERVICE_NAME))
+        print("Metrics and log events sent for " + msg)
     except Exception as e:
         print("Failed to obtain pipelines for project",project_id," due to error ", e)
 
@@ -282,15 +290,14 @@ def grab_pipeline_data(pipelineobject,current_project,project_id,GLAB_SERVICE_NA
 
 
 async def get_pipelines(current_project,project_id,GLAB_SERVICE_NAME):
-    print("Gathering pipeline data for project " + str(project_id) + " this may take while...")
     pipelines = current_project.pipelines.list(iterator=True, per_page=100, updated_after=str((datetime.now(timezone.utc).replace(tzinfo=pytz.utc) - timedelta(minutes=int(GLAB_EXPORT_LAST_MINUTES)))))
-    print("Found",len(pipelines),"pipelines","in project",project_id, "processsing please wait...")
     if len(pipelines)> 0: # check if there are pipelines in this project
         # setting workers to 5 due to gitlab api limits
         with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor: 
             for pipelineobject in pipelines:
                 executor.submit(grab_pipeline_data, pipelineobject,current_project,project_id,GLAB_SERVICE_NAME)
                 executor.submit(get_jobs, pipelineobject,current_project,project_id,GLAB_SERVICE_NAME)
+    return len(pipelines)
 
 def parse_job(data):
     job_json = data[0]
@@ -300,34 +307,42 @@ def parse_job(data):
     try:
         #Grab job attributes
         current_job_attributes = create_resource_attributes(parse_attributes(job_json),GLAB_SERVICE_NAME)
-        attributes_j = {"gitlab.resource.type": "job"}
         #Check wich dimension to set on each metric
         job_metrics_attributes = parse_metrics_attributes(current_job_attributes)
-        job_metrics_attributes[2].update(attributes_j)
+        job_metrics_attributes[2]["gitlab.resource.type"] = "job"
         # Update attributes for the log events
-        current_job_attributes.update(attributes_j)
+        current_job_attributes["gitlab.resource.type"] = "job"
         #Send job metrics with configured dimensions
         gitlab_jobs_duration.add(float(job_metrics_attributes[0]),job_metrics_attributes[2])
         gitlab_jobs_queued_duration.add(float(job_metrics_attributes[1]),job_metrics_attributes[2])
         #Send job data as log events with attributes
         msg = "Job: "+ str(job_json['id']) + " - " + "from project: " + str(project_id)+ " - " + str(GLAB_SERVICE_NAME) 
         global_logger._log(level=logging.INFO,msg=msg,extra=current_job_attributes,args="")   
-        print("Metrics sent for job: " + str(job_json['id'])+ " for pipeline: "+ str(current_pipeline_json['id'])+ " from project: " + str(project_id)+ " - " + str(GLAB_SERVICE_NAME))
-        print("Log events sent for job: " + str(job_json['id']) + " for pipeline: "+ str(current_pipeline_json['id'])+ " from project: " + str(project_id)+ " - " + str(GLAB_SERVICE_NAME))          
+        print("Metrics and log events sent for " + msg + " - pipeline: " + str(current_pipeline_json['id']))
 
     except Exception as e:
         print("Failed to obtain jobs for project",project_id," due to error ", e)
         
 def get_jobs(pipelineobject,current_project,project_id,GLAB_SERVICE_NAME):
     global q
-    current_pipeline=current_project.pipelines.get(pipelineobject.id)
+    # Full pipeline details are fetched by grab_pipeline_data, a lazy object is enough to list the jobs
+    current_pipeline=current_project.pipelines.get(pipelineobject.id, lazy=True)
     jobs = current_pipeline.jobs.list(get_all=True)
-    current_pipeline_json = json.loads(current_pipeline.to_json())
+    current_pipeline_json = json.loads(pipelineobject.to_json())
     if len(jobs) > 0:
+        export_after = datetime.now(timezone.utc).replace(tzinfo=pytz.utc) - timedelta(minutes=int(GLAB_EXPORT_LAST_MINUTES))
         #Collect job information
         for job in jobs:
             #Ensure we don't export data for exporters jobs and only export jobs that have been created in the last GLAB_EXPORT_LAST_MINUTES minutes
             job_json = json.loads(job.to_json())
-            if (job_json['stage']) not in ["new-relic-exporter", "new-relic-metrics-exporter"] and zulu.parse(job_json["created_at"]) >= (datetime.now(timezone.utc).replace(tzinfo=pytz.utc) - timedelta(minutes=int(GLAB_EXPORT_LAST_MINUTES))):
-                q.put([job_json,project_id,GLAB_SERVICE_NAME,"job",current_pipeline_json])     
+            if job_json['stage'] not in EXPORTER_STAGES and zulu.parse(job_json["created_at"]) >= export_after:
+                q.put([job_json,project_id,GLAB_SERVICE_NAME,"job",current_pipeline_json])
 
+# Parser to use for each type of resource placed on the queue
+resource_parsers = {
+    "deployment": parse_deployment,
+    "environment": parse_environment,
+    "release": parse_release,
+    "pipeline": parse_pipeline,
+    "job": parse_job,
+}
@@ -4,13 +4,28 @@ from get_resources import grab_data,get_runners
 from global_variables import *
 import asyncio
 import datetime
+import concurrent.futures
+from collections import Counter
 
 # Start timer
-start_time = time.time()
-    
-def send_to_nr(project):
-   asyncio.run(grab_data(project))
+start_time = time.perf_counter()
 
+# Export cadence is fixed for the lifetime of the process, parse it once
+export_interval_minutes = int(GLAB_EXPORT_LAST_MINUTES)
+    
+async def export_projects(projects):
+    # grab_data never suspends, so projects are still exported one after another, tally the status each one reports
+    results = Counter()
+    for task in asyncio.as_completed([grab_data(project) for project in projects]):
+        try:
+            if await task:
+                results["completed"] += 1
+            else:
+                results["failed"] += 1
+        except Exception as e:
+            results["failed"] += 1
+            print("Failed to export project data due to " + repr(e))
+    return results
 
 def run():
     projects = []
@@ -19,14 +34,20 @@ def run():
     print("Found total of " + str(len(projects)) + " projects using -> OWNED: " + str(GLAB_PROJECT_OWNERSHIP) + " and VISIBILITIES: " + str(GLAB_PROJECT_VISIBILITIES) + ". \nChecking which ones match provided paths and project regex configuration")  
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    tasks = [send_to_nr(project) for project in projects]
-    
     try:
-        return loop.run_until_complete(asyncio.wait(tasks))
+        results = loop.run_until_complete(export_projects(projects))
+        print("Projects processed: " + str(results["completed"]) + ", failed: " + str(results["failed"]))
     finally:
         loop.close()
         asyncio.set_event_loop(None)
-        return "DONE"
+    return "DONE"
+
+def run_with_runners():
+    # Runners don't depend on project data, collect them while projects are being processed
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        runners = executor.submit(get_runners)
+        run()
+        runners.result()
     
 if __name__ == '__main__':
     projects = []
@@ -38,27 +59,26 @@ if __name__ == '__main__':
         if GLAB_STANDALONE:
             print("Running on standalone mode")
             # Run once, then schedule every GLAB_EXPORT_LAST_MINUTES
-            run()
-            get_runners()
+            run_with_runners()
             gl.session.close()
-            print("Exporter finished in "+str(datetime.timedelta(seconds=(time.time() - start_time)))+ " minutes")
+            print("Exporter finished in "+str(datetime.timedelta(seconds=(time.perf_counter() - start_time)))+ " minutes")
             time.sleep(1)
-            schedule.every(int(GLAB_EXPORT_LAST_MINUTES)).minutes.do(run) 
+            schedule.every(export_interval_minutes).minutes.do(run) 
             while 1:
                 n = schedule.idle_seconds()
                 if n is None:
                     # no more jobs
                     break
                 elif n > 0:
-                    # sleep exactly the right amount of time
-                    print("Next job run in " + str(round(int(n)/60)) + " minutes")
+                    # sleep exactly the right amount of time, only report waits of a minute or more
+                    if n >= 60:
+                        print("Next job run in " + str(round(n/60)) + " minutes")
                     time.sleep(n)
                 schedule.run_pending()
         else:
-            run()
-            get_runners()
+            run_with_runners()
             gl.session.close()
-            print("Exporter finished in "+str(datetime.timedelta(seconds=(time.time() - start_time)))+ " minutes")
+            print("Exporter finished in "+str(datetime.timedelta(seconds=(time.perf_counter() - start_time)))+ " minutes")
 
             
 